@@ -1,10 +1,27 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, abort, g, has_app_context, Response
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 from datetime import datetime
 from flask_cors import CORS
+import click
 import os
-from datetime import datetime, time
-from sqlalchemy import func
+import glob
+import hmac
+import json
+import base64
+import re
+import sys
+import heapq
+import random
+import threading
+from collections import OrderedDict, Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice, count
+from contextvars import ContextVar
+from time import perf_counter
+from datetime import datetime, time, timedelta
+from sqlalchemy import func, select, bindparam, create_engine, event, inspect
+from sqlalchemy.orm import selectinload, joinedload, configure_mappers
 
 app = Flask(__name__)
 CORS(app)
@@ -13,8 +30,30 @@ CORS(app)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///dental_clinic.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = 'your-secret-key-here-change-in-production'
-
-db = SQLAlchemy(app)
+app.config['DEFAULT_PAGE_SIZE'] = 50
+app.config['MAX_PAGE_SIZE'] = 200
+# One database per clinic, selected by the X-Clinic-ID header
+app.config['CLINIC_DATABASE_URI'] = 'sqlite:///' + os.path.join(app.instance_path, 'clinic_{clinic_id}.db')
+app.config['MAX_CLINIC_ENGINES'] = 32
+# Admin endpoints require this token in the X-Admin-Token header
+app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN')
+# Request profiling: off unless sampling is enabled or an admin sends X-Profile.
+# Read at startup: SQL timing listeners are only attached to engines when enabled.
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+app.config['PROFILE_INTERVAL'] = 0.001  # seconds between stack samples
+app.config['PROFILE_BUFFER_SIZE'] = 50
+
+class TenantSession(Session):
+    """Session that binds to the current request's clinic database"""
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context() and g.get('clinic_id'):
+            return get_clinic_engine(g.clinic_id)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(app, session_options={'class_': TenantSession})
+
+# Daily bookable slots for every doctor: 2:30 PM → 5:30 PM
+APPOINTMENT_SLOTS = [time(hour, 30) for hour in range(14, 18)]
 
 # ==================== Models ====================
 
@@ -56,6 +95,8 @@ class Appointment(db.Model):
     
     notes = db.relationship('DoctorNote', backref='appointment', uselist=False, cascade='all, delete-orphan')
 
+    __table_args__ = (db.Index('ix_appointments_date_id', 'appointment_date', 'id'),)
+
 class DoctorNote(db.Model):
     __tablename__ = 'doctor_notes'
     id = db.Column(db.Integer, primary_key=True)
@@ -87,6 +128,327 @@ class Review(db.Model):
     comment = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (db.Index('ix_reviews_created_id', 'created_at', 'id'),)
+
+class ChangeLog(db.Model):
+    __tablename__ = 'change_log'
+    id = db.Column(db.Integer, primary_key=True)  # sync cursor
+    entity_type = db.Column(db.String(30), nullable=False)  # appointment, doctor_note, medical_history, review, patient
+    entity_id = db.Column(db.Integer, nullable=False)
+    action = db.Column(db.String(10), nullable=False)  # create, update, delete
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_change_log_entity', 'entity_type', 'entity_id'),)
+
+# ==================== Change Log ====================
+
+CHANGE_LOG_ENTITY_TYPES = {
+    Appointment: 'appointment',
+    DoctorNote: 'doctor_note',
+    MedicalHistory: 'medical_history',
+    Review: 'review',
+    Patient: 'patient'
+}
+
+def record_change(entity, action):
+    """Append a change log entry; committed together with the entity change"""
+    if entity.id is None:
+        db.session.flush()
+    db.session.add(ChangeLog(
+        entity_type=CHANGE_LOG_ENTITY_TYPES[type(entity)],
+        entity_id=entity.id,
+        action=action
+    ))
+
+def compact_change_log():
+    """Keep only the latest change log entry per entity"""
+    latest = db.session.query(func.max(ChangeLog.id)).group_by(ChangeLog.entity_type, ChangeLog.entity_id)
+    removed = ChangeLog.query.filter(ChangeLog.id.not_in(latest)).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
+
+@app.cli.command('compact-change-log')
+@click.option('--clinic', 'clinic_ids', multiple=True, help='Clinic database to compact (repeatable).')
+@click.option('--all-clinics', is_flag=True, help='Compact the default database and every provisioned clinic database.')
+def compact_change_log_command(clinic_ids, all_clinics):
+    """Compact the sync change log (run periodically, e.g. from cron)"""
+    if all_clinics:
+        clinic_ids = list_clinic_ids()
+    if all_clinics or not clinic_ids:
+        click.echo(f'Default database: removed {compact_change_log()} superseded change log entries')
+
+    for clinic_id in clinic_ids:
+        if not CLINIC_ID_PATTERN.match(clinic_id) or get_clinic_engine(clinic_id) is None:
+            click.echo(f'Clinic {clinic_id}: not found', err=True)
+            continue
+        with app.app_context():
+            g.clinic_id = clinic_id
+            click.echo(f'Clinic {clinic_id}: removed {compact_change_log()} superseded change log entries')
+
+# ==================== Pagination ====================
+
+def encode_cursor(values):
+    """Encode sort key values into an opaque cursor"""
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, columns):
+    """Decode an opaque cursor back into sort key values; raises ValueError"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError('Invalid cursor')
+
+    decoded = []
+    for col, value in zip(columns, values):
+        if isinstance(col.type, db.DateTime) and isinstance(value, str):
+            try:
+                decoded.append(datetime.fromisoformat(value))
+            except ValueError:
+                raise ValueError('Invalid cursor')
+        elif isinstance(col.type, db.Integer) and isinstance(value, int) and not isinstance(value, bool):
+            decoded.append(value)
+        else:
+            raise ValueError('Invalid cursor')
+    return decoded
+
+def is_paginated_request():
+    """Pagination is opt-in so clients expecting a bare list keep working"""
+    return 'limit' in request.args or 'cursor' in request.args
+
+def paginate_keyset(query, columns, descending=False):
+    """Apply keyset pagination from request args; returns (rows, next_cursor)"""
+    query_order = [col.desc() if descending else col.asc() for col in columns]
+    if not is_paginated_request():
+        return query.order_by(*query_order).all(), None
+
+    limit = request.args.get('limit', app.config['DEFAULT_PAGE_SIZE'], type=int)
+    limit = min(max(limit, 1), app.config['MAX_PAGE_SIZE'])
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        key = db.tuple_(*columns)
+        values = db.tuple_(*decode_cursor(cursor, columns))
+        query = query.filter(key < values if descending else key > values)
+
+    rows = query.order_by(*query_order).limit(limit + 1).all()
+
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor([getattr(rows[-1], col.key) for col in columns])
+
+def paginated_response(key, items, next_cursor):
+    """Bare list for unpaginated requests, {key: items, next_cursor} otherwise"""
+    if not is_paginated_request():
+        return jsonify(items), 200
+    return jsonify({key: items, 'next_cursor': next_cursor}), 200
+
+# ==================== Cached Statements ====================
+# Hot-path statements are built once at import time with bound parameters, so
+# each request only binds values; the compiled SQL is reused from the cache.
+
+configure_mappers()  # set up backrefs such as Appointment.doctor
+
+PATIENT_BY_EMAIL = select(Patient).where(Patient.email == bindparam('email'))
+
+DOCTOR_BY_EMAIL = select(Doctor).where(Doctor.email == bindparam('email'))
+
+BOOKED_TIMES = select(Appointment.appointment_date).where(
+    Appointment.doctor_id == bindparam('doctor_id'),
+    func.date(Appointment.appointment_date) == bindparam('target_date'),
+    Appointment.status == 'scheduled'
+)
+
+SCHEDULED_APPOINTMENT_AT = select(Appointment.id).where(
+    Appointment.doctor_id == bindparam('doctor_id'),
+    Appointment.appointment_date == bindparam('appointment_date'),
+    Appointment.status == 'scheduled'
+).limit(1)
+
+APPOINTMENT_WITH_DOCTOR = select(Appointment).options(joinedload(Appointment.doctor)).where(
+    Appointment.id == bindparam('appointment_id')
+)
+
+# ==================== Admin Access ====================
+
+def is_admin_request():
+    token = app.config['ADMIN_TOKEN']
+    return bool(token) and hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token)
+
+# ==================== Clinic Routing ====================
+
+CLINIC_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+_clinic_engines = OrderedDict()
+_clinic_engines_lock = threading.Lock()
+
+def _clinic_database_exists(engine):
+    # Connecting to a missing SQLite file would create it, so check the path first
+    if engine.url.get_backend_name() == 'sqlite' and not os.path.exists(engine.url.database or ''):
+        return False
+    return inspect(engine).has_table(Patient.__tablename__)
+
+def get_clinic_engine(clinic_id, create=False):
+    """Return the clinic's engine, or None if the clinic is not provisioned.
+
+    Engines are created lazily and the least recently used are evicted. Only
+    create=True (used by init_database) provisions a new clinic database.
+    """
+    with _clinic_engines_lock:
+        engine = _clinic_engines.get(clinic_id)
+        if engine is not None:
+            _clinic_engines.move_to_end(clinic_id)
+            return engine
+
+    # Connecting and DDL happen outside the lock so other clinics are not blocked
+    engine = create_engine(app.config['CLINIC_DATABASE_URI'].format(clinic_id=clinic_id))
+    instrument_engine(engine)
+    if create:
+        os.makedirs(app.instance_path, exist_ok=True)
+        db.metadata.create_all(bind=engine)
+    elif not _clinic_database_exists(engine):
+        engine.dispose()
+        return None
+
+    with _clinic_engines_lock:
+        existing = _clinic_engines.get(clinic_id)
+        if existing is not None:
+            engine.dispose()
+            _clinic_engines.move_to_end(clinic_id)
+            return existing
+
+        _clinic_engines[clinic_id] = engine
+        while len(_clinic_engines) > app.config['MAX_CLINIC_ENGINES']:
+            _, evicted = _clinic_engines.popitem(last=False)
+            evicted.dispose()
+        return engine
+
+def list_clinic_ids():
+    """Clinic ids with a database on disk (SQLite clinic databases only)"""
+    uri = app.config['CLINIC_DATABASE_URI']
+    if not uri.startswith('sqlite:///'):
+        return []
+    prefix, suffix = uri[len('sqlite:///'):].split('{clinic_id}')
+    clinic_ids = (path[len(prefix):len(path) - len(suffix)] for path in glob.glob(prefix + '*' + suffix))
+    return sorted(c for c in clinic_ids if CLINIC_ID_PATTERN.match(c))
+
+@app.before_request
+def select_clinic():
+    """Route the request to a clinic database when X-Clinic-ID is sent"""
+    clinic_id = request.headers.get('X-Clinic-ID')
+    if clinic_id is None:
+        return None
+    if not CLINIC_ID_PATTERN.match(clinic_id):
+        return jsonify({'error': 'Invalid clinic id'}), 400
+    # init_database provisions new clinics; everything else needs an existing one
+    if request.endpoint != 'init_database' and get_clinic_engine(clinic_id) is None:
+        return jsonify({'error': 'Clinic not found'}), 404
+    g.clinic_id = clinic_id
+
+# ==================== Request Profiling ====================
+
+_profiles = deque(maxlen=app.config['PROFILE_BUFFER_SIZE'])
+_profile_ids = count(1)
+_active_profiler = ContextVar('active_profiler', default=None)
+
+class RequestProfiler:
+    """Samples one thread's stack and collects the SQL it runs"""
+    def __init__(self, interval):
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.stacks = Counter()
+        self.queries = []
+        self._stopped = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self.started_at = datetime.now()
+        self._started = perf_counter()
+        self._token = _active_profiler.set(self)
+        self._sampler.start()
+
+    def stop(self):
+        _active_profiler.reset(self._token)
+        self._stopped.set()
+        self._sampler.join()
+        self.duration = perf_counter() - self._started
+
+    def collapsed(self):
+        return '\n'.join(f'{stack} {samples}' for stack, samples in self.stacks.items())
+
+def _profile_before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _active_profiler.get() is not None:
+        context._profile_started = perf_counter()
+
+def _profile_after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profiler = _active_profiler.get()
+    if profiler is None or not hasattr(context, '_profile_started'):
+        return
+    profiler.queries.append({
+        'statement': statement,
+        'duration_ms': round((perf_counter() - context._profile_started) * 1000, 3)
+    })
+
+def profiling_configured():
+    return bool(app.config['ADMIN_TOKEN']) or bool(app.config['PROFILE_SAMPLE_RATE'])
+
+def instrument_engine(engine):
+    """Attach the profiling SQL listeners; call once, before the engine is shared"""
+    if not profiling_configured():
+        return
+    event.listen(engine, 'before_cursor_execute', _profile_before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _profile_after_cursor_execute)
+
+with app.app_context():
+    instrument_engine(db.engine)
+
+@app.before_request
+def start_profiling():
+    """Profile the request when asked for by an admin or picked by sampling"""
+    if not profiling_configured():
+        return None
+    rate = app.config['PROFILE_SAMPLE_RATE']
+    if request.path.startswith('/api/admin/profiles'):
+        return None
+    if not (request.headers.get('X-Profile') and is_admin_request()) and not (rate and random.random() < rate):
+        return None
+
+    g.profiler = RequestProfiler(app.config['PROFILE_INTERVAL'])
+    g.profiler.start()
+
+@app.teardown_request
+def stop_profiling(exc):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return
+    profiler.stop()
+    _profiles.append({
+        'id': next(_profile_ids),
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'clinic_id': g.get('clinic_id'),
+        'started_at': profiler.started_at.isoformat(),
+        'duration_ms': round(profiler.duration * 1000, 3),
+        'sql_time_ms': round(sum(q['duration_ms'] for q in profiler.queries), 3),
+        'queries': profiler.queries,
+        'samples': sum(profiler.stacks.values()),
+        'collapsed': profiler.collapsed()
+    })
+
 # ==================== Authentication Routes ====================
 
 @app.route('/api/auth/signup', methods=['POST'])
@@ -113,6 +475,7 @@ def signup():
     )
     
     db.session.add(patient)
+    record_change(patient, 'create')
     db.session.commit()
     
     return jsonify({
@@ -137,7 +500,7 @@ def login():
     
     if user_type == 'doctor':
         # Doctor login
-        doctor = Doctor.query.filter_by(email=data['email'].lower().strip()).first()
+        doctor = db.session.execute(DOCTOR_BY_EMAIL, {'email': data['email'].lower().strip()}).scalars().first()
         
         if not doctor or (doctor.password and doctor.password != data['password']):
             return jsonify({'error': 'Incorrect email or password'}), 401
@@ -154,7 +517,7 @@ def login():
         }), 200
     else:
         # Patient login
-        patient = Patient.query.filter_by(email=data['email'].lower().strip()).first()
+        patient = db.session.execute(PATIENT_BY_EMAIL, {'email': data['email'].lower().strip()}).scalars().first()
         
         if not patient or patient.password != data['password']:
             return jsonify({'error': 'Incorrect email or password'}), 401
@@ -189,9 +552,12 @@ def get_appointments():
     if status:
         query = query.filter_by(status=status)
 
-    appointments = query.all()
+    try:
+        appointments, next_cursor = paginate_keyset(query, [Appointment.appointment_date, Appointment.id])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    return jsonify([
+    return paginated_response('appointments', [
         {
             'id': apt.id,
             'patient_name': apt.patient.name,
@@ -203,10 +569,12 @@ def get_appointments():
             'created_at': apt.created_at.isoformat()
         }
         for apt in appointments
-    ]), 200
+    ], next_cursor)
 @app.route('/api/appointments/<int:id>', methods=['GET'])
 def get_appointment_by_id(id):
-    apt = Appointment.query.get_or_404(id)
+    apt = db.session.execute(APPOINTMENT_WITH_DOCTOR, {'appointment_id': id}).scalars().first()
+    if not apt:
+        abort(404)
 
     return jsonify({
         'id': apt.id,
@@ -235,20 +603,87 @@ def get_available_slots():
     except ValueError:
         return jsonify({'success': False, 'error': 'Invalid date format'}), 400
 
-    booked = Appointment.query.filter(
-        Appointment.doctor_id == doctor_id,
-        func.date(Appointment.appointment_date) == target_date,
-        Appointment.status == 'scheduled'
-    ).all()
-
-    booked_times = {apt.appointment_date.strftime('%H:%M') for apt in booked}
+    booked = db.session.execute(BOOKED_TIMES, {'doctor_id': doctor_id, 'target_date': target_date}).scalars()
+    booked_times = {booked_at.strftime('%H:%M') for booked_at in booked}
 
-    all_slots = [time(hour, 30) for hour in range(14, 18)]  # 2 PM → 5 PM
-    available_slots = [slot.strftime('%H:%M') for slot in all_slots if slot.strftime('%H:%M') not in booked_times]
+    available_slots = [slot.strftime('%H:%M') for slot in APPOINTMENT_SLOTS if slot.strftime('%H:%M') not in booked_times]
 
     return jsonify({'success': True, 'available_slots': available_slots}), 200
 
 
+# =========================
+# NEXT AVAILABLE SLOTS
+# =========================
+def _free_slots(doctor_id, start, end, booked, not_before):
+    """Yield (slot_datetime, doctor_id) for a doctor's free slots in order"""
+    day = start
+    while day <= end:
+        for slot in APPOINTMENT_SLOTS:
+            slot_dt = datetime.combine(day, slot)
+            if slot_dt >= not_before and (doctor_id, slot_dt) not in booked:
+                yield slot_dt, doctor_id
+        day += timedelta(days=1)
+
+
+@app.route('/api/appointments/next-available', methods=['GET'])
+def get_next_available_slots():
+    """Get the earliest free slots across all doctors (optionally by specialization)"""
+    specialization = request.args.get('specialization')
+    limit = request.args.get('limit', 5, type=int)
+
+    try:
+        start = datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') else datetime.now().date()
+        end = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else start + timedelta(days=7)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid date format'}), 400
+
+    if end < start:
+        return jsonify({'success': False, 'error': 'to must not be before from'}), 400
+    if end - start > timedelta(days=90):
+        return jsonify({'success': False, 'error': 'Date range cannot exceed 90 days'}), 400
+    if limit < 1:
+        return jsonify({'success': False, 'error': 'limit must be positive'}), 400
+    limit = min(limit, 50)
+
+    query = Doctor.query
+    if specialization:
+        query = query.filter(func.lower(Doctor.specialization) == specialization.strip().lower())
+    doctors = {d.id: d for d in query.all()}
+
+    if not doctors:
+        return jsonify({'success': True, 'slots': []}), 200
+
+    # One query for every booked slot of the matching doctors in the window
+    # Truncated to the minute so a booking at 14:30:15 blocks the 14:30 slot, as in available-slots
+    booked = {
+        (doctor_id, booked_at.replace(second=0, microsecond=0))
+        for doctor_id, booked_at in db.session.query(Appointment.doctor_id, Appointment.appointment_date).filter(
+            Appointment.doctor_id.in_(doctors.keys()),
+            Appointment.appointment_date >= datetime.combine(start, time.min),
+            Appointment.appointment_date < datetime.combine(end + timedelta(days=1), time.min),
+            Appointment.status == 'scheduled'
+        )
+    }
+
+    not_before = datetime.now()
+    merged = heapq.merge(*(_free_slots(doctor_id, start, end, booked, not_before) for doctor_id in doctors))
+
+    return jsonify({
+        'success': True,
+        'slots': [
+            {
+                'doctor_id': doctor_id,
+                'doctor_name': doctors[doctor_id].name,
+                'specialization': doctors[doctor_id].specialization,
+                'date': slot_dt.strftime('%Y-%m-%d'),
+                'time': slot_dt.strftime('%H:%M'),
+                'appointment_date': slot_dt.isoformat()
+            }
+            for slot_dt, doctor_id in islice(merged, limit)
+        ]
+    }), 200
+
+
 # =========================
 # BOOK APPOINTMENT
 # =========================
@@ -264,10 +699,9 @@ def book_appointment():
         return jsonify({'error':'Invalid date format'}), 400
 
     # التحقق من وجود موعد مسبق
-    existing = Appointment.query.filter(
-        Appointment.doctor_id==data['doctor_id'],
-        Appointment.appointment_date==appointment_date,
-        Appointment.status=='scheduled'
+    existing = db.session.execute(
+        SCHEDULED_APPOINTMENT_AT,
+        {'doctor_id': data['doctor_id'], 'appointment_date': appointment_date}
     ).first()
     if existing:
         return jsonify({'error':'Time slot already booked'}), 409
@@ -280,6 +714,7 @@ def book_appointment():
         status='scheduled'
     )
     db.session.add(apt)
+    record_change(apt, 'create')
     db.session.commit()
 
     return jsonify({'message':'Appointment booked successfully'}), 201
@@ -322,6 +757,7 @@ def edit_appointment(id):
     if 'status' in data:
         apt.status = data['status']
 
+    record_change(apt, 'update')
     db.session.commit()
 
     return jsonify({
@@ -348,6 +784,7 @@ def cancel_appointment(id):
         return jsonify({'error': 'Cannot cancel completed appointment'}), 400
 
     apt.status = 'cancelled'
+    record_change(apt, 'update')
     db.session.commit()
 
     return jsonify({'message': 'Appointment cancelled successfully'}), 200
@@ -379,6 +816,8 @@ def add_doctor_notes(id):
     apt.status = 'completed'
     
     db.session.add(notes)
+    record_change(notes, 'create')
+    record_change(apt, 'update')
     db.session.commit()
     
     return jsonify({
@@ -412,6 +851,7 @@ def update_doctor_notes(id):
         apt.notes.notes = data['notes']
     
     apt.notes.updated_at = datetime.utcnow()
+    record_change(apt.notes, 'update')
     db.session.commit()
     
     return jsonify({
@@ -471,10 +911,12 @@ def update_medical_history(id):
     if patient.medical_history:
         # Update existing
         history = patient.medical_history
+        action = 'update'
     else:
         # Create new
         history = MedicalHistory(patient_id=id)
         db.session.add(history)
+        action = 'create'
     
     if 'allergies' in data:
         history.allergies = data['allergies']
@@ -488,6 +930,7 @@ def update_medical_history(id):
         history.notes = data['notes']
     
     history.updated_at = datetime.utcnow()
+    record_change(history, action)
     db.session.commit()
     
     return jsonify({
@@ -512,16 +955,19 @@ def get_reviews():
     if doctor_id:
         query = query.filter_by(doctor_id=doctor_id)
     
-    reviews = query.order_by(Review.created_at.desc()).all()
+    try:
+        reviews, next_cursor = paginate_keyset(query, [Review.created_at, Review.id], descending=True)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    return jsonify([{
+    return paginated_response('reviews', [{
         'id': r.id,
         'patient_name': r.patient.name,
         'doctor_name': r.doctor.name,
         'rating': r.rating,
         'comment': r.comment,
         'created_at': r.created_at.isoformat()
-    } for r in reviews]), 200
+    } for r in reviews], next_cursor)
 
 @app.route('/api/reviews', methods=['POST'])
 def add_review():
@@ -542,6 +988,7 @@ def add_review():
     )
     
     db.session.add(review)
+    record_change(review, 'create')
     db.session.commit()
     
     return jsonify({
@@ -568,6 +1015,7 @@ def update_review(id):
     if 'comment' in data:
         review.comment = data['comment']
     
+    record_change(review, 'update')
     db.session.commit()
     
     return jsonify({
@@ -582,6 +1030,7 @@ def update_review(id):
 def delete_review(id):
     """Delete review"""
     review = Review.query.get_or_404(id)
+    record_change(review, 'delete')
     db.session.delete(review)
     db.session.commit()
     
@@ -631,6 +1080,7 @@ def create_patient():
     )
     
     db.session.add(patient)
+    record_change(patient, 'create')
     db.session.commit()
     
     return jsonify({
@@ -646,14 +1096,18 @@ def create_patient():
 @app.route('/api/patients', methods=['GET'])
 def get_patients():
     """Get all patients"""
-    patients = Patient.query.all()
-    return jsonify([{
+    try:
+        patients, next_cursor = paginate_keyset(Patient.query, [Patient.id])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return paginated_response('patients', [{
         'id': p.id,
         'name': p.name,
         'email': p.email,
         'phone': p.phone,
         'diseases': p.diseases
-    } for p in patients]), 200
+    } for p in patients], next_cursor)
 
 @app.route('/api/patients/<int:id>', methods=['GET'])
 def get_patient(id):
@@ -669,6 +1123,68 @@ def get_patient(id):
         'created_at': patient.created_at.isoformat()
     }), 200
 
+@app.route('/api/patients/<int:id>/dashboard', methods=['GET'])
+def get_patient_dashboard(id):
+    """Get patient profile, history, appointments and notes in one request"""
+    past_limit = request.args.get('past_limit', type=int)
+
+    patient = Patient.query.options(selectinload(Patient.medical_history)).get_or_404(id)
+
+    now = datetime.now()
+    appointments = Appointment.query.options(
+        selectinload(Appointment.doctor),
+        selectinload(Appointment.notes)
+    ).filter(Appointment.patient_id == id)
+
+    future = appointments.filter(Appointment.appointment_date >= now).order_by(Appointment.appointment_date.asc()).all()
+    upcoming = [apt for apt in future if apt.status != 'cancelled']
+    cancelled_upcoming = [apt for apt in future if apt.status == 'cancelled']
+    past_query = appointments.filter(Appointment.appointment_date < now).order_by(Appointment.appointment_date.desc())
+    if past_limit is not None and past_limit >= 0:
+        past_query = past_query.limit(past_limit)
+    past = past_query.all()
+
+    def appointment_dict(apt):
+        return {
+            'id': apt.id,
+            'doctor_id': apt.doctor_id,
+            'doctor_name': apt.doctor.name,
+            'appointment_date': apt.appointment_date.isoformat(),
+            'reason': apt.reason,
+            'symptoms': apt.symptoms,
+            'status': apt.status,
+            'notes': {
+                'diagnosis': apt.notes.diagnosis,
+                'treatment': apt.notes.treatment,
+                'prescription': apt.notes.prescription,
+                'notes': apt.notes.notes,
+                'updated_at': apt.notes.updated_at.isoformat()
+            } if apt.notes else None
+        }
+
+    history = patient.medical_history
+    return jsonify({
+        'patient': {
+            'id': patient.id,
+            'name': patient.name,
+            'email': patient.email,
+            'phone': patient.phone,
+            'diseases': patient.diseases,
+            'created_at': patient.created_at.isoformat()
+        },
+        'medical_history': {
+            'allergies': history.allergies,
+            'previous_treatments': history.previous_treatments,
+            'chronic_conditions': history.chronic_conditions,
+            'medications': history.medications,
+            'notes': history.notes,
+            'updated_at': history.updated_at.isoformat()
+        } if history else None,
+        'upcoming_appointments': [appointment_dict(apt) for apt in upcoming],
+        'cancelled_upcoming_appointments': [appointment_dict(apt) for apt in cancelled_upcoming],
+        'past_appointments': [appointment_dict(apt) for apt in past]
+    }), 200
+
 @app.route('/api/patients/with-appointments', methods=['GET'])
 def get_patients_with_appointments():
     """Get all patients who have appointments"""
@@ -679,16 +1195,19 @@ def get_patients_with_appointments():
     if doctor_id:
         query = query.filter(Appointment.doctor_id == doctor_id)
     
-    patients = query.all()
+    try:
+        patients, next_cursor = paginate_keyset(query, [Patient.id])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    return jsonify([{
+    return paginated_response('patients', [{
         'id': p.id,
         'name': p.name,
         'email': p.email,
         'phone': p.phone,
         'diseases': p.diseases,
         'total_appointments': len(p.appointments)
-    } for p in patients]), 200
+    } for p in patients], next_cursor)
 
 # ==================== Doctor Routes ====================
 
@@ -729,21 +1248,190 @@ def create_doctor():
 @app.route('/api/doctors', methods=['GET'])
 def get_doctors():
     """Get all doctors"""
-    doctors = Doctor.query.all()
-    return jsonify([{
+    try:
+        doctors, next_cursor = paginate_keyset(Doctor.query, [Doctor.id])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return paginated_response('doctors', [{
         'id': d.id,
         'name': d.name,
         'specialization': d.specialization,
         'email': d.email
-    } for d in doctors]), 200
+    } for d in doctors], next_cursor)
+
+# ==================== Sync Routes ====================
+
+SYNC_SERIALIZERS = {
+    'appointment': (Appointment, lambda apt: {
+        'id': apt.id,
+        'patient_id': apt.patient_id,
+        'doctor_id': apt.doctor_id,
+        'appointment_date': apt.appointment_date.isoformat(),
+        'reason': apt.reason,
+        'symptoms': apt.symptoms,
+        'status': apt.status,
+        'created_at': apt.created_at.isoformat()
+    }),
+    'doctor_note': (DoctorNote, lambda n: {
+        'id': n.id,
+        'appointment_id': n.appointment_id,
+        'diagnosis': n.diagnosis,
+        'treatment': n.treatment,
+        'prescription': n.prescription,
+        'notes': n.notes,
+        'created_at': n.created_at.isoformat(),
+        'updated_at': n.updated_at.isoformat()
+    }),
+    'medical_history': (MedicalHistory, lambda h: {
+        'id': h.id,
+        'patient_id': h.patient_id,
+        'allergies': h.allergies,
+        'previous_treatments': h.previous_treatments,
+        'chronic_conditions': h.chronic_conditions,
+        'medications': h.medications,
+        'notes': h.notes,
+        'updated_at': h.updated_at.isoformat()
+    }),
+    'review': (Review, lambda r: {
+        'id': r.id,
+        'patient_id': r.patient_id,
+        'doctor_id': r.doctor_id,
+        'rating': r.rating,
+        'comment': r.comment,
+        'created_at': r.created_at.isoformat()
+    }),
+    'patient': (Patient, lambda p: {
+        'id': p.id,
+        'name': p.name,
+        'email': p.email,
+        'phone': p.phone,
+        'diseases': p.diseases,
+        'created_at': p.created_at.isoformat()
+    })
+}
+
+@app.route('/api/sync', methods=['GET'])
+def sync_changes():
+    """Get entities changed since a cursor, in cursor order"""
+    since = request.args.get('since', 0, type=int)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 500)
+
+    entries = ChangeLog.query.filter(ChangeLog.id > since).order_by(ChangeLog.id).limit(limit + 1).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    # Only the latest change per entity within this batch
+    latest = {}
+    for entry in entries:
+        latest.pop((entry.entity_type, entry.entity_id), None)
+        latest[(entry.entity_type, entry.entity_id)] = entry
+
+    # One query per entity type for the current state of changed rows
+    entities = {}
+    for entity_type, (model, _) in SYNC_SERIALIZERS.items():
+        ids = [entity_id for (t, entity_id), entry in latest.items() if t == entity_type and entry.action != 'delete']
+        if ids:
+            for obj in model.query.filter(model.id.in_(ids)).all():
+                entities[(entity_type, obj.id)] = obj
+
+    changes = []
+    for key, entry in latest.items():
+        obj = entities.get(key)
+        changes.append({
+            'cursor': entry.id,
+            'entity_type': entry.entity_type,
+            'entity_id': entry.entity_id,
+            'action': entry.action if obj is not None else 'delete',
+            'data': SYNC_SERIALIZERS[entry.entity_type][1](obj) if obj is not None else None,
+            'changed_at': entry.created_at.isoformat()
+        })
+
+    return jsonify({
+        'changes': changes,
+        'next_cursor': entries[-1].id if entries else since,
+        'has_more': has_more
+    }), 200
+
+@app.route('/api/sync/compact', methods=['POST'])
+def compact_sync_log():
+    """Compact the sync change log"""
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+
+    removed = compact_change_log()
+    return jsonify({'message': 'Change log compacted', 'removed_entries': removed}), 200
+
+# ==================== Admin Routes ====================
+
+CLINIC_STATS_MODELS = {
+    'patients': Patient,
+    'doctors': Doctor,
+    'appointments': Appointment,
+    'reviews': Review
+}
+
+def _clinic_counts(clinic_id):
+    engine = get_clinic_engine(clinic_id)
+    if engine is None:
+        return None
+    with engine.connect() as conn:
+        return {
+            name: conn.execute(select(func.count()).select_from(model.__table__)).scalar()
+            for name, model in CLINIC_STATS_MODELS.items()
+        }
+
+@app.route('/api/admin/clinics/stats', methods=['GET'])
+def get_clinic_stats():
+    """Get record counts for each clinic database, queried in parallel"""
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+
+    clinic_ids = [c.strip() for c in request.args.get('clinic_ids', '').split(',') if c.strip()]
+
+    if not clinic_ids:
+        return jsonify({'error': 'clinic_ids is required'}), 400
+    if not all(CLINIC_ID_PATTERN.match(c) for c in clinic_ids):
+        return jsonify({'error': 'Invalid clinic id'}), 400
+
+    with ThreadPoolExecutor(max_workers=min(len(clinic_ids), 8)) as pool:
+        results = dict(zip(clinic_ids, pool.map(_clinic_counts, clinic_ids)))
+
+    counts = {clinic_id: c for clinic_id, c in results.items() if c is not None}
+    return jsonify({
+        'clinics': counts,
+        'unknown_clinics': [clinic_id for clinic_id, c in results.items() if c is None],
+        'totals': {name: sum(c[name] for c in counts.values()) for name in CLINIC_STATS_MODELS}
+    }), 200
+
+@app.route('/api/admin/profiles', methods=['GET'])
+def get_profiles():
+    """Get recent request profiles; format=collapsed gives flame graph input"""
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+
+    profile_id = request.args.get('id', type=int)
+    profiles = [p for p in _profiles if profile_id is None or p['id'] == profile_id]
+
+    if request.args.get('format') == 'collapsed':
+        # Identical stacks from different requests are merged by the flame graph tools
+        return Response('\n'.join(p['collapsed'] for p in profiles if p['collapsed']) + '\n', mimetype='text/plain')
+
+    return jsonify({'profiles': profiles}), 200
 
 # ==================== Initialize Database ====================
 
 @app.route('/api/init-db', methods=['POST'])
 def init_database():
-    """Initialize database with sample data"""
-    db.drop_all()
-    db.create_all()
+    """Initialize database (the request's clinic database, if any) with sample data"""
+    if g.get('clinic_id'):
+        # Provisioning or wiping a clinic database is an admin operation
+        if not is_admin_request():
+            return jsonify({'error': 'Forbidden'}), 403
+        get_clinic_engine(g.clinic_id, create=True)
+    engine = db.session.get_bind()
+    db.metadata.drop_all(bind=engine)
+    db.metadata.create_all(bind=engine)
     
     # Create sample doctors
     doctor1 = Doctor(
@@ -783,12 +1471,14 @@ def home():
                 'get': 'GET /api/appointments/<id>',
                 'update': 'PUT /api/appointments/<id>',
                 'cancel': 'DELETE /api/appointments/<id>',
-                'available_slots': 'GET /api/appointments/available-slots'
+                'available_slots': 'GET /api/appointments/available-slots',
+                'next_available': 'GET /api/appointments/next-available'
             },
             'patients': {
                 'list': 'GET /api/patients',
                 'get': 'GET /api/patients/<id>',
                 'with_appointments': 'GET /api/patients/with-appointments',
+                'dashboard': 'GET /api/patients/<id>/dashboard',
                 'history': 'GET/POST /api/patients/<id>/history'
             },
             'doctors': {
@@ -803,8 +1493,14 @@ def home():
                 'add': 'POST /api/appointments/<id>/notes',
                 'get': 'GET /api/appointments/<id>/notes'
             },
+            'sync': {
+                'changes': 'GET /api/sync?since=<cursor>',
+                'compact': 'POST /api/sync/compact'
+            },
             'admin': {
-                'init_db': 'POST /api/init-db'
+                'init_db': 'POST /api/init-db',
+                'clinic_stats': 'GET /api/admin/clinics/stats?clinic_ids=<a,b,...>',
+                'profiles': 'GET /api/admin/profiles'
             }
         }
     }), 200
@@ -0,0 +1,106 @@
+"""Microbenchmark: prebuilt hot-path statements vs. the Model.query style.
+
+Runs against a throwaway clinic database in a temp directory, so the real
+instance database is never touched.
+
+    python bench_hot_queries.py [--iterations 20000]
+"""
+import argparse
+import os
+import tempfile
+import warnings
+from datetime import date, datetime
+from time import perf_counter
+
+from flask import g
+from sqlalchemy.exc import LegacyAPIWarning
+
+from app import (app, db, func, get_clinic_engine, Patient, Doctor, Appointment,
+                 PATIENT_BY_EMAIL, BOOKED_TIMES, SCHEDULED_APPOINTMENT_AT, APPOINTMENT_WITH_DOCTOR)
+
+CLINIC_ID = 'bench'
+DAY = date(2030, 1, 1)
+SLOT = datetime(2030, 1, 1, 14, 30)
+
+
+def seed():
+    doctor = Doctor(name='Dr. Bench', specialization='General Dentistry', email='bench@clinic.com')
+    patient = Patient(name='Bench Patient', email='patient@bench.com', password='x')
+    db.session.add_all([doctor, patient])
+    db.session.flush()
+    db.session.add(Appointment(patient_id=patient.id, doctor_id=doctor.id, appointment_date=SLOT))
+    db.session.commit()
+    return doctor.id, patient.email
+
+
+def cases(doctor_id, email):
+    def query_get():
+        apt = Appointment.query.get(1)
+        apt.doctor.name
+        db.session.expunge_all()
+
+    def cached_get():
+        apt = db.session.execute(APPOINTMENT_WITH_DOCTOR, {'appointment_id': 1}).scalars().first()
+        apt.doctor.name
+        db.session.expunge_all()
+
+    return [
+        ('login lookup',
+         lambda: Patient.query.filter_by(email=email).first(),
+         lambda: db.session.execute(PATIENT_BY_EMAIL, {'email': email}).scalars().first()),
+        ('available-slots query',
+         lambda: Appointment.query.filter(
+             Appointment.doctor_id == doctor_id,
+             func.date(Appointment.appointment_date) == DAY,
+             Appointment.status == 'scheduled'
+         ).all(),
+         lambda: db.session.execute(BOOKED_TIMES, {'doctor_id': doctor_id, 'target_date': DAY}).scalars().all()),
+        ('booking conflict check',
+         lambda: Appointment.query.filter(
+             Appointment.doctor_id == doctor_id,
+             Appointment.appointment_date == SLOT,
+             Appointment.status == 'scheduled'
+         ).first(),
+         lambda: db.session.execute(
+             SCHEDULED_APPOINTMENT_AT, {'doctor_id': doctor_id, 'appointment_date': SLOT}
+         ).first()),
+        ('appointment by id', query_get, cached_get),
+    ]
+
+
+# Query.get() is the legacy call the old get_appointment_by_id used
+warnings.filterwarnings('ignore', category=LegacyAPIWarning)
+
+
+def per_call_us(fn, iterations):
+    for _ in range(min(iterations, 500)):
+        fn()
+    started = perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app.config['CLINIC_DATABASE_URI'] = 'sqlite:///' + os.path.join(tmp, 'clinic_{clinic_id}.db')
+        with app.app_context():
+            get_clinic_engine(CLINIC_ID, create=True)
+            g.clinic_id = CLINIC_ID
+            doctor_id, email = seed()
+
+            print(f'{"path":26s} {"Model.query":>12s} {"cached":>10s} {"speedup":>8s}')
+            for name, old, new in cases(doctor_id, email):
+                old_us = per_call_us(old, args.iterations)
+                new_us = per_call_us(new, args.iterations)
+                print(f'{name:26s} {old_us:9.1f} us {new_us:7.1f} us {old_us / new_us:7.2f}x')
+            db.session.remove()
+        get_clinic_engine(CLINIC_ID).dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Benchmark: /api/appointments/next-available vs. the per-doctor, per-day loop.
+
+Seeds a throwaway clinic database in a temp directory with many doctors and a
+mostly booked schedule, so the real instance database is never touched.
+
+    python bench_next_available.py [--doctors 120] [--days 30] [--booked 0.9]
+"""
+import argparse
+import os
+import random
+import tempfile
+from datetime import date, datetime, timedelta
+from time import perf_counter
+
+from flask import g
+
+from app import app, db, get_clinic_engine, APPOINTMENT_SLOTS, Patient, Doctor, Appointment
+
+CLINIC_ID = 'bench'
+HEADERS = {'X-Clinic-ID': CLINIC_ID}
+SPECIALIZATIONS = ['General Dentistry', 'Orthodontics', 'Endodontics']
+
+
+def seed(doctors, days, booked):
+    random.seed(0)
+    doctor_rows = [
+        Doctor(name=f'Dr. {i}', specialization=SPECIALIZATIONS[i % len(SPECIALIZATIONS)], email=f'dr{i}@clinic.com')
+        for i in range(doctors)
+    ]
+    patient = Patient(name='Bench Patient', email='patient@bench.com', password='x')
+    db.session.add_all(doctor_rows + [patient])
+    db.session.flush()
+
+    today = date.today()
+    db.session.add_all([
+        Appointment(patient_id=patient.id, doctor_id=doctor.id, appointment_date=datetime.combine(today + timedelta(days=day), slot))
+        for doctor in doctor_rows
+        for day in range(days)
+        for slot in APPOINTMENT_SLOTS
+        if random.random() < booked
+    ])
+    db.session.commit()
+
+
+def time_ms(fn, repeat):
+    started = perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (perf_counter() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--doctors', type=int, default=120)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--booked', type=float, default=0.9, help='fraction of slots already booked')
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app.config['CLINIC_DATABASE_URI'] = 'sqlite:///' + os.path.join(tmp, 'clinic_{clinic_id}.db')
+        with app.app_context():
+            get_clinic_engine(CLINIC_ID, create=True)
+            g.clinic_id = CLINIC_ID
+            seed(args.doctors, args.days, args.booked)
+            db.session.remove()
+
+        client = app.test_client()
+        today = date.today()
+        to = (today + timedelta(days=args.days - 1)).isoformat()
+        print(f'{args.doctors} doctors, {args.days} days, {args.booked:.0%} booked')
+
+        for label, specialization in [('all doctors', ''), ('one specialization', 'Orthodontics')]:
+            url = f'/api/appointments/next-available?to={to}&limit={args.limit}&specialization={specialization}'
+            ms = time_ms(lambda: client.get(url, headers=HEADERS), args.repeat)
+            print(f'next-available, {label:20s} {ms:10.1f} ms')
+
+        def client_loop():
+            for doctor_id in range(1, args.doctors + 1):
+                for day in range(args.days):
+                    target = (today + timedelta(days=day)).isoformat()
+                    client.get(f'/api/appointments/available-slots?doctor_id={doctor_id}&date={target}', headers=HEADERS)
+
+        print(f'available-slots per doctor per day {time_ms(client_loop, 1):10.1f} ms')
+        get_clinic_engine(CLINIC_ID).dispose()
+
+
+if __name__ == '__main__':
+    main()